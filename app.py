@@ -1,5 +1,6 @@
 import streamlit as st
 st.set_page_config(page_title="宇宙事業デザインセッションプラットフォーム（仮）", layout="wide")
+from llm_utils import inject_css; inject_css()
 st.title("宇宙事業デザインセッションプラットフォーム（仮）")
 t1, t2, t3 = st.tabs(["Tab1: ユースケース入力", "Tab2: 構成方針提示", "Tab3: 統合プラン（Under Construction）"])
 with t1:
@@ -0,0 +1,77 @@
+# llm_utils.py
+# 共通: 環境変数/Secrets・Groqクライアント・JSON補助・CSS（Tab1/Tab2で共有）
+import functools
+import os
+from typing import Dict, Any, Optional
+
+import orjson
+import streamlit as st
+from dotenv import load_dotenv
+from groq import Groq
+
+
+# ========= Env / Secrets =========
+@functools.lru_cache(maxsize=None)
+def load_env() -> None:
+    """.env の読み込みはプロセス内で1度だけ。"""
+    load_dotenv()
+
+
+@functools.lru_cache(maxsize=None)
+def get_api_key() -> Optional[str]:
+    load_env()
+    return st.secrets.get("GROQ_API_KEY") or os.getenv("GROQ_API_KEY")
+
+
+@functools.lru_cache(maxsize=None)
+def get_model() -> str:
+    # ※ 既存互換: 外から上書きできるようにしつつ安全なデフォルトを用意
+    load_env()
+    return st.secrets.get("GROQ_MODEL") or os.getenv("GROQ_MODEL") or "llama-3.1-8b-instant"
+
+
+@st.cache_resource
+def get_groq_client() -> Optional[Groq]:
+    """Groqクライアントをプロセス内で1つだけ生成し、再実行/タブ間で接続プールを共有する。"""
+    api_key = get_api_key()
+    return Groq(api_key=api_key) if api_key else None
+
+
+# ========= Helpers =========
+class LLMOutputError(ValueError):
+    """LLM応答を期待するJSONとして解釈できない。生テキストを text に保持する。"""
+
+    def __init__(self, message: str, text: str):
+        super().__init__(message)
+        self.text = text
+
+
+def debug_enabled() -> bool:
+    """URLに ?debug=1 が付いている時のみデバッグ表示を出す。"""
+    return st.query_params.get("debug") == "1"
+
+
+def json_loads_safe(s: str) -> Dict[str, Any]:
+    try:
+        return orjson.loads(s)
+    except orjson.JSONDecodeError:
+        return {}
+
+
+# ========= CSS =========
+CSS = """
+<style>
+html, body, [class*="css"] { font-size: 16px; }
+h1 { font-size: 2rem; }
+h2 { font-size: 1.5rem; margin-top: .5rem; }
+h3 { font-size: 1.25rem; margin-top: .5rem; }
+ul, ol { line-height: 1.6; }
+.stButton>button { padding: .6rem 1rem; font-size: 1rem; }
+.block-container { padding-top: .75rem; }
+</style>
+"""
+
+
+def inject_css():
+    """既存UIを壊さない範囲で視認性UP。全タブ共通のため app.py から1回の実行につき1度だけ呼ぶ。"""
+    st.markdown(CSS, unsafe_allow_html=True)
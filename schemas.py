@@ -0,0 +1,44 @@
+# schemas.py
+# 共通: Tab1の観測設計ドラフト（LLM出力JSON）のスキーマ（Tab1/Tab2で共有）
+from typing import Any, List, Optional, Union
+
+import msgspec
+
+
+class Requirements(msgspec.Struct):
+    # LLMの揺れ（文字列/配列/null）はそのまま受け、表示側でプレースホルダに寄せる
+    actions: Union[List[Any], str, None] = None
+    bands: Union[List[Any], str, None] = None
+    gsd_m: Union[int, float, str, List[Any], None] = None
+    revisit_days: Union[int, float, str, List[Any], None] = None
+
+
+class DraftPlan(msgspec.Struct):
+    """観測設計ドラフト（LLM出力JSON）。draft_plan / confirmed_plan に保持する。"""
+    usecase: Optional[str] = None
+    goal: Optional[str] = None
+    requirements: Optional[Requirements] = None
+
+    def is_empty(self) -> bool:
+        """{} や全項目 null の応答（表示・確定の対象外）なら True。"""
+        return (
+            not self.usecase
+            and not self.goal
+            and (self.requirements is None or self.requirements == Requirements())
+        )
+
+
+def as_text(value: Any, sep: str = "・") -> str:
+    """配列は sep で連結、None は空文字にして表示/プロンプト用の文字列に揃える。"""
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        return sep.join(str(v) for v in value)
+    return str(value)
+
+
+def as_list(value: Any) -> List[Any]:
+    """単一の文字列も1要素の箇条書きとして扱う。"""
+    if not value:
+        return []
+    return value if isinstance(value, list) else [value]
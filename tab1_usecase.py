@@ -1,68 +1,27 @@
 # tab1_usecase.py
 # Tab1: ユースケース入力 → 観測設計ドラフト（LLM案）生成
-import os
-import json
-import re
 from typing import Dict, Any, List, Optional
 
+import msgspec
 import streamlit as st
-from dotenv import load_dotenv
-from groq import Groq
 
-
-# ========= Env / Secrets =========
-load_dotenv()
-
-API_KEY = st.secrets.get("GROQ_API_KEY") or os.getenv("GROQ_API_KEY")
-# ※ 既存互換: 外から上書きできるようにしつつ安全なデフォルトを用意
-MODEL = st.secrets.get("GROQ_MODEL") or os.getenv("GROQ_MODEL") or "llama-3.1-8b-instant"
-
-client = Groq(api_key=API_KEY) if API_KEY else None
+from llm_utils import LLMOutputError, debug_enabled, get_api_key, get_groq_client, get_model
+from schemas import DraftPlan, Requirements, as_list, as_text
 
 
 # ========= Helpers (既存踏襲 + 安全化) =========
-def _extract_json_block(text: str) -> str:
-    """```json ... ``` or 最初の { ... } を抽出（簡易ネスト対応）。"""
-    if not text:
-        return "{}"
-
-    m = re.search(r"```(?:json)?\s*(\{.*?\})\s*```", text, flags=re.DOTALL)
-    if m:
-        return m.group(1).strip()
-
-    start = text.find("{")
-    if start < 0:
-        return "{}"
-    depth = 0
-    for i, ch in enumerate(text[start:], start=start):
-        if ch == "{":
-            depth += 1
-        elif ch == "}":
-            depth -= 1
-            if depth == 0:
-                return text[start : i + 1].strip()
-    return "{}"
-
-
-def _json_loads_safe(s: str) -> Dict[str, Any]:
-    try:
-        return json.loads(s)
-    except Exception:
-        return {}
-
-
 def _prompt_messages(uc_text: str) -> List[Dict[str, str]]:
     """元の設計思想を保ちつつ、名称/用語だけ整える。"""
     sys = (
         "あなたは衛星データの観測設計エンジニアです。"
         "ユーザーのユースケース説明から、観測要件を簡潔にドラフト化してください。"
-        "出力時は、人間可読の短い要約→JSON（有効な1オブジェクト）の順で提示してください。"
+        "出力は有効なJSONオブジェクト1つのみとしてください。"
     )
     usr = f"""ユースケース説明:
 {uc_text}
 
 出力要件:
-1) まず人間可読の短い要約を書いた後、JSONを1つだけ返す
+1) JSONオブジェクトを1つだけ返す（前後に説明文を付けない）
 2) JSONスキーマ（固定）:
 {{
   "usecase": "短いユースケース名",
@@ -78,7 +37,7 @@ def _prompt_messages(uc_text: str) -> List[Dict[str, str]]:
 注意:
 - 数値は数値型
 - 不明なら妥当な初期値を推奨
-- 1000トークン以内
+- 600トークン以内
 """
     return [
         {"role": "system", "content": sys},
@@ -86,27 +45,60 @@ def _prompt_messages(uc_text: str) -> List[Dict[str, str]]:
     ]
 
 
-def _inject_css():
-    """既存UIを壊さない範囲で視認性UP。"""
-    st.markdown(
-        """
-<style>
-html, body, [class*="css"] { font-size: 16px; }
-h1 { font-size: 2rem; }
-h2 { font-size: 1.5rem; margin-top: .5rem; }
-h3 { font-size: 1.25rem; margin-top: .5rem; }
-ul, ol { line-height: 1.6; }
-.stButton>button { padding: .6rem 1rem; font-size: 1rem; }
-.block-container { padding-top: .75rem; }
-</style>
-        """,
-        unsafe_allow_html=True,
+@st.cache_data(ttl=3600, max_entries=128, show_spinner=False)
+def _cached_completion(model: str, uc_text: str, temperature: float = 0.1) -> DraftPlan:
+    """ユースケース説明から観測設計ドラフトを生成・解析する（解析失敗時は LLMOutputError）。"""
+    resp = get_groq_client().chat.completions.create(
+        model=model,
+        response_format={"type": "json_object"},
+        temperature=temperature,
+        max_tokens=600,
+        messages=_prompt_messages(uc_text),
     )
+    text = resp.choices[0].message.content or ""
+    try:
+        draft = msgspec.json.decode(text, type=DraftPlan)
+    except msgspec.MsgspecError as e:
+        raise LLMOutputError(str(e), text) from e
+    if draft.is_empty():
+        raise LLMOutputError("観測設計ドラフトのJSONが空でした", text)
+    return draft
+
+
+def _draft_view(draft: DraftPlan) -> Dict[str, Any]:
+    """ドラフトの人間可読ビュー（markdown）を組み立てる。"""
+    usecase = draft.usecase or "（名称未設定）"
+    goal = draft.goal or "（観測目的未記載）"
+    req = draft.requirements or Requirements()
+    actions = as_list(req.actions)
+    bands = as_text(req.bands) or "（未指定）"
+    gsd_m = as_text(req.gsd_m, sep=" / ") or "（未指定）"
+    revisit = as_text(req.revisit_days, sep=" / ") or "（未指定）"
+
+    # ✅ 観測要件の下には 3 指標のみを掲載
+    requirements = [
+        "### 観測要件",
+        # 使う波長帯
+        "**使う波長帯（観測バンド）** 例：可視・近赤外・短波赤外・熱赤外",
+        bands,
+        # 目標の解像度
+        "**目標の解像度（地上分解能） [m]** 例：10mなら圃場レベルの把握が可能",
+        gsd_m,
+        # 目標の更新間隔
+        "**目標の更新間隔（観測頻度） [日]** 例：3日なら天候を跨いで監視しやすい",
+        revisit,
+    ]
+    actions_md = ["\n".join(f"- {a}" for a in actions)] if actions else []
+    return {
+        "head_md": f"**ユースケース名：** {usecase}\n\n**観測目的：** {goal}",
+        "has_actions": bool(actions),
+        "body_md": "\n\n".join(actions_md + requirements),
+    }
 
 
 # ========= Main =========
 def render():
-    _inject_css()
+    client = get_groq_client()
 
     st.caption("ユースケースを自由に記述")
     default_uc = (
@@ -122,79 +114,55 @@ def render():
         if not client:
             st.warning("GROQ_API_KEY が未設定です（Manage app → Settings → Secrets）。LLM生成は無効。")
         if st.button("観測設計ドラフトを生成（LLM）", type="primary", disabled=(client is None)):
-            with st.spinner("LLMで観測設計ドラフトを作成中..."):
-                try:
-                    resp = client.chat.completions.create(
-                        model=MODEL,
-                        temperature=0.1,
-                        max_tokens=1000,
-                        messages=_prompt_messages(uc_text),
-                    )
-                except Exception as e:
-                    st.error(f"Groq API呼び出しエラー: {e}")
-                    return
-
-                text = resp.choices[0].message.content or ""
-                try:
-                    data = _json_loads_safe(_extract_json_block(text))
-                    st.session_state["draft_plan"] = data
-                except Exception as e:
-                    st.error(f"JSON解析に失敗しました: {e}")
-                    with st.expander("LLM生テキスト（デバッグ用）", expanded=False):
-                        st.code(text, language="markdown")
+            try:
+                with st.spinner("LLMで観測設計ドラフトを作成中..."):
+                    data = _cached_completion(get_model(), uc_text)
+            except LLMOutputError as e:
+                st.error(f"JSON解析に失敗しました: {e}")
+                with st.expander("LLM生テキスト（デバッグ用）", expanded=False):
+                    st.code(e.text, language="markdown")
+                return
+            except Exception as e:
+                st.error(f"Groq API呼び出しエラー: {e}")
+                return
+
+            st.session_state["draft_plan"] = data
+            st.session_state["draft_view"] = _draft_view(data)
 
     with col_clear:
         if st.button("ユースケースを修正", type="secondary"):
             # 出力のみクリア（入力テキストは保持）
             st.session_state.pop("draft_plan", None)
+            st.session_state.pop("draft_view", None)
             st.success("出力を削除しました。")
             st.rerun()
 
+    draft: Optional[DraftPlan] = st.session_state.get("draft_plan")
+    if draft is not None and draft.is_empty():
+        draft = None
+
     with col_ok:
-        if st.session_state.get("draft_plan") and st.button("OK（Tab2へ反映）", type="secondary"):
+        if draft is not None and st.button("OK（Tab2へ反映）", type="secondary"):
             st.session_state["confirmed_plan"] = st.session_state["draft_plan"]
             st.success("観測設計ドラフトを確定しました。Tab2に進めます。")
 
-    draft: Optional[Dict[str, Any]] = st.session_state.get("draft_plan")
-    if not draft:
+    if draft is None:
         return
 
     # === 人間可読ビュー（名称・用語をリフレッシュ） ===
     st.subheader("観測設計ドラフト（LLM案）")
 
-    usecase = draft.get("usecase") or "（名称未設定）"
-    goal = draft.get("goal") or "（観測目的未記載）"
-    req = draft.get("requirements") or {}
-    actions = req.get("actions") or []
-    bands = req.get("bands") or "（未指定）"
-    gsd_m = req.get("gsd_m")
-    revisit = req.get("revisit_days")
-
-    st.markdown(f"**ユースケース名：** {usecase}")
-    st.markdown(f"**観測目的：** {goal}")
+    view = st.session_state.get("draft_view") or _draft_view(draft)
+    st.markdown(view["head_md"])
 
     # ✅ 観測目的の直下に「やること（actions）」を移動
-    if actions:
+    if view["has_actions"]:
         st.caption("観測で実施すること")
-        st.markdown("- " + "\n- ".join(actions))
-
-    # ✅ 観測要件の下には 3 指標のみを掲載
-    st.markdown("### 観測要件")
-
-    # 使う波長帯
-    st.markdown("**使う波長帯（観測バンド）** 例：可視・近赤外・短波赤外・熱赤外")
-    st.markdown(str(bands))
-
-    # 目標の解像度
-    st.markdown("**目標の解像度（地上分解能） [m]** 例：10mなら圃場レベルの把握が可能")
-    st.markdown(str(gsd_m) if gsd_m is not None else "（未指定）")
-
-    # 目標の更新間隔
-    st.markdown("**目標の更新間隔（観測頻度） [日]** 例：3日なら天候を跨いで監視しやすい")
-    st.markdown(str(revisit) if revisit is not None else "（未指定）")
-
-    # （任意）デバッグ支援は残しつつ折りたたみ
-    with st.expander("デバッグ（MODEL / APIキー有無 / JSON原文）", expanded=False):
-        st.write("MODEL =", MODEL)
-        st.write("Has GROQ_API_KEY =", bool(API_KEY))
-        st.code(json.dumps(draft, ensure_ascii=False, indent=2), language="json")
+    st.markdown(view["body_md"])
+
+    # （任意）デバッグ支援は ?debug=1 の時のみ折りたたみで表示
+    if debug_enabled():
+        with st.expander("デバッグ（MODEL / APIキー有無 / JSON原文）", expanded=False):
+            st.write("MODEL =", get_model())
+            st.write("Has GROQ_API_KEY =", bool(get_api_key()))
+            st.code(msgspec.json.format(msgspec.json.encode(draft), indent=2).decode(), language="json")
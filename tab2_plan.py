@@ -1,84 +1,32 @@
 # tab2_plan.py
 # Tab2: Tab1の観測設計ドラフト（confirmed_plan）を受け取り、
 #       センサ構成/衛星候補/運用・処理/リスク/次アクション等の「構成方針」をLLMで提案するタブ
-import os
-import json
-import re
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple
 
+import msgspec
+import orjson
 import streamlit as st
-from dotenv import load_dotenv
-from groq import Groq
 
-# ========= Env / Secrets =========
-load_dotenv()
-
-API_KEY = st.secrets.get("GROQ_API_KEY") or os.getenv("GROQ_API_KEY")
-MODEL   = st.secrets.get("GROQ_MODEL")   or os.getenv("GROQ_MODEL")   or "llama-3.1-8b-instant"
-client  = Groq(api_key=API_KEY) if API_KEY else None
+from llm_utils import LLMOutputError, debug_enabled, get_api_key, get_groq_client, get_model, json_loads_safe
+from schemas import DraftPlan, Requirements, as_text
 
 
 # ========= Helpers =========
-def _inject_css():
-    st.markdown(
-        """
-<style>
-html, body, [class*="css"] { font-size: 16px; }
-h1 { font-size: 2rem; }
-h2 { font-size: 1.5rem; margin-top: .5rem; }
-h3 { font-size: 1.25rem; margin-top: .5rem; }
-ul, ol { line-height: 1.6; }
-.stButton>button { padding: .6rem 1rem; font-size: 1rem; }
-.block-container { padding-top: .75rem; }
-</style>
-        """,
-        unsafe_allow_html=True,
-    )
-
-
-def _extract_json_block(text: str) -> str:
-    """```json ... ``` もしくは最初の { ... } を抽出（簡易ネスト対応）"""
-    if not text:
-        return "{}"
-    m = re.search(r"```(?:json)?\s*(\{.*?\})\s*```", text, flags=re.DOTALL)
-    if m:
-        return m.group(1).strip()
-    start = text.find("{")
-    if start < 0:
-        return "{}"
-    depth = 0
-    for i, ch in enumerate(text[start:], start=start):
-        if ch == "{":
-            depth += 1
-        elif ch == "}":
-            depth -= 1
-            if depth == 0:
-                return text[start : i + 1].strip()
-    return "{}"
-
-
-def _json_loads_safe(s: str) -> Dict[str, Any]:
-    try:
-        return json.loads(s)
-    except Exception:
-        return {}
-
-
-def _prompt_messages(plan: Dict[str, Any]) -> List[Dict[str, str]]:
+def _prompt_messages(plan: DraftPlan) -> List[Dict[str, str]]:
     """Tab1のconfirmed_planを入力に、構成方針（JSON）を生成するプロンプト。"""
-    usecase = plan.get("usecase", "")
-    goal = plan.get("goal", "")
-    req  = plan.get("requirements", {})
-    actions = req.get("actions", [])
-    bands   = req.get("bands", "")
-    gsd_m   = req.get("gsd_m", None)
-    revisit = req.get("revisit_days", None)
+    usecase = plan.usecase or ""
+    goal = plan.goal or ""
+    req  = plan.requirements or Requirements()
+    actions = req.actions or []
+    bands   = as_text(req.bands)
+    gsd_m   = req.gsd_m
+    revisit = req.revisit_days
 
     sys = (
         "あなたはリモートセンシングの観測設計アーキテクトです。"
         "与えられた観測要件（バンド/解像度/更新間隔/やること）を満たすための"
         "『構成方針』を簡潔にまとめてください。"
-        "出力は日本語の短い要約のあと、必ず有効なJSONオブジェクトで返します。"
+        "出力は必ず有効なJSONオブジェクト1つのみで返します（値は日本語）。"
     )
 
     usr = f"""前提:
@@ -90,8 +38,7 @@ def _prompt_messages(plan: Dict[str, Any]) -> List[Dict[str, str]]:
 - 目標更新間隔[日]: {revisit}
 
 出力形式:
-1) まず人間可読で2〜4行の短い要約
-2) その後にJSONを1つだけ。スキーマ:
+JSONを1つだけ返す（前後に説明文を付けない）。スキーマ:
 {{
   "stack": {{
     "sensors": [
@@ -131,7 +78,7 @@ def _prompt_messages(plan: Dict[str, Any]) -> List[Dict[str, str]]:
 - JSONの数値は数値型で
 - 候補衛星はオープン/商用を混ぜて2〜6件程度で具体名を
 - actions/bands/gsd/revisitの整合をとること
-- 1000トークン以内
+- 800トークン以内
 """
     return [
         {"role": "system", "content": sys},
@@ -139,54 +86,126 @@ def _prompt_messages(plan: Dict[str, Any]) -> List[Dict[str, str]]:
     ]
 
 
-# ========= Main =========
-def render():
-    _inject_css()
-    st.header("構成方針提示（Tab2）")
+@st.cache_data(ttl=3600, max_entries=128, show_spinner=False)
+def _cached_completion(model: str, plan_json: bytes, temperature: float = 0.1) -> Tuple[Dict[str, Any], str]:
+    """confirmed_planから構成方針を生成し、JSONと表示用markdownを返す（解析失敗時は LLMOutputError）"""
+    resp = get_groq_client().chat.completions.create(
+        model=model,
+        response_format={"type": "json_object"},
+        temperature=temperature,
+        max_tokens=900,
+        messages=_prompt_messages(msgspec.json.decode(plan_json, type=DraftPlan)),
+    )
+    text = resp.choices[0].message.content or ""
+    data = json_loads_safe(text)
+    if not isinstance(data, dict) or not data:
+        raise LLMOutputError("構成方針のJSONを解釈できませんでした", text)
+    try:
+        view_md = _design_markdown(data)
+    except (AttributeError, TypeError) as e:
+        raise LLMOutputError(f"構成方針のJSON構造が想定と異なります: {e}", text) from e
+    return data, view_md
 
-    plan = st.session_state.get("confirmed_plan")
-    if not plan:
-        st.info("Tab1で『OK（次へ）』を押すと、ここに構成方針が表示されます。")
-        return
 
-    # 生成/確定/クリア ボタン行
+def _design_markdown(design: Dict[str, Any]) -> str:
+    """構成方針の人間可読ビュー（markdown）を組み立てる"""
+    stack = design.get("stack", {})
+    sensors = stack.get("sensors", [])
+    sats = stack.get("satellite_candidates", [])
+
+    # Stack / 衛星候補
+    lines: List[str] = ["### センサ構成（Stack）"]
+    if sensors:
+        lines.append("\n".join(
+            f"- **[{i}] {s.get('type','(type)')}**｜"
+            f"バンド: {s.get('bands','-')}｜"
+            f"GSD目標[m]: {s.get('gsd_target_m','-')}｜"
+            f"更新間隔目標[日]: {s.get('revisit_target_days','-')}  \n"
+            f"  用途: {s.get('usage','-')}"
+            for i, s in enumerate(sensors, 1)
+        ))
+    else:
+        lines.append("- （センサ構成が未提示です）")
+
+    lines.append("#### 衛星候補")
+    if sats:
+        lines.append("\n".join(f"- **{s.get('name','(名称不明)')}**：{s.get('why','')}" for s in sats))
+    else:
+        lines.append("- （候補なし）")
+    return "\n\n".join(lines)
+
+
+# ========= Main =========
+@st.fragment
+def _action_row(plan: DraftPlan):
+    """生成/確定/クリア ボタン行。クリック時はこの行だけを再実行し、ビュー全体の再描画を避ける。"""
+    client = get_groq_client()
     col_gen, col_ok, col_clear = st.columns([1, 1, 1])
 
     with col_gen:
         if not client:
             st.warning("GROQ_API_KEY が未設定です（Manage app → Settings → Secrets）。LLM生成は無効。")
         if st.button("構成方針を生成（LLM）", type="primary", disabled=(client is None)):
-            with st.spinner("LLMで構成方針案を作成中..."):
-                try:
-                    resp = client.chat.completions.create(
-                        model=MODEL,
-                        temperature=0.1,
-                        max_tokens=1100,
-                        messages=_prompt_messages(plan),
-                    )
-                    text = resp.choices[0].message.content or ""
-                    data = _json_loads_safe(_extract_json_block(text))
-                    st.session_state["design_plan_draft"] = data
-                except Exception as e:
-                    st.error(f"Groq API呼び出しエラー: {e}")
+            try:
+                with st.spinner("LLMで構成方針案を作成中..."):
+                    data, view_md = _cached_completion(get_model(), msgspec.json.encode(plan))
+                st.session_state["design_plan_draft"] = data
+                st.session_state["design_draft_md"] = view_md
+            except LLMOutputError as e:
+                st.error(f"JSON解析に失敗しました: {e}")
+                with st.expander("LLM生テキスト（デバッグ用）", expanded=False):
+                    st.code(e.text, language="markdown")
+            except Exception as e:
+                st.error(f"Groq API呼び出しエラー: {e}")
+            else:
+                # 下のビューを更新するためアプリ全体を再実行
+                st.rerun()
 
     with col_ok:
         if st.session_state.get("design_plan_draft") and st.button("OK（確定）", type="secondary"):
+            # 以前の確定案を表示中なら、確定後にビューが変わるためアプリ全体を再実行
+            stale = (
+                st.session_state.get("design_plan_confirmed") is not None
+                and st.session_state["design_plan_confirmed"] != st.session_state["design_plan_draft"]
+            )
             st.session_state["design_plan_confirmed"] = st.session_state["design_plan_draft"]
+            st.session_state["design_confirmed_md"] = st.session_state.get("design_draft_md")
+            if stale:
+                # 再実行で消えないよう、完了メッセージは render() 側で表示する
+                st.session_state["design_flash"] = "構成方針案を確定しました。"
+                st.rerun()
             st.success("構成方針案を確定しました。")
 
     with col_clear:
         if st.button("修正が必要", type="secondary"):
             st.session_state.pop("design_plan_draft", None)
             st.session_state.pop("design_plan_confirmed", None)
+            st.session_state.pop("design_draft_md", None)
+            st.session_state.pop("design_confirmed_md", None)
             st.success("Tab2の出力を削除しました。")
             st.rerun()
 
+
+def render():
+    st.header("構成方針提示（Tab2）")
+
+    plan: Optional[DraftPlan] = st.session_state.get("confirmed_plan")
+    if plan is None:
+        st.info("Tab1で『OK（次へ）』を押すと、ここに構成方針が表示されます。")
+        return
+
+    # 生成/確定/クリア ボタン行
+    _action_row(plan)
+    flash = st.session_state.pop("design_flash", None)
+    if flash:
+        st.success(flash)
+
     # 表示対象の選択：確定済みがあれば優先
     design: Optional[Dict[str, Any]] = (
         st.session_state.get("design_plan_confirmed")
         or st.session_state.get("design_plan_draft")
     )
+    view_key = "design_confirmed_md" if st.session_state.get("design_plan_confirmed") else "design_draft_md"
 
     if not design:
         st.stop()
@@ -194,37 +213,15 @@ def render():
     # ===== 人間可読ビュー =====
     st.subheader("構成方針（LLM案）")
 
-    stack = design.get("stack", {})
-    sensors = stack.get("sensors", [])
-    sats = stack.get("satellite_candidates", [])
-    complements = stack.get("complements", {})
-
-    processing = design.get("processing", {})
-    deliverables = design.get("deliverables", [])
-    risks = design.get("risks", [])
-    next_actions = design.get("next_actions", [])
-    assumptions = design.get("assumptions", [])
+    st.markdown(st.session_state.get(view_key, ""))
 
-    # Stack
-    st.markdown("### センサ構成（Stack）")
-    if sensors:
-        for i, s in enumerate(sensors, 1):
-            st.markdown(
-                f"- **[{i}] {s.get('type','(type)')}**｜"
-                f"バンド: {s.get('bands','-')}｜"
-                f"GSD目標[m]: {s.get('gsd_target_m','-')}｜"
-                f"更新間隔目標[日]: {s.get('revisit_target_days','-')}  \n"
-                f"  用途: {s.get('usage','-')}"
-            )
-    else:
-        st.markdown("- （センサ構成が未提示です）")
-
-    st.markdown("#### 衛星候補")
-    if sats:
-        for s in sats:
-            st.markdown(f"- **{s.get('name','(名称不明)')}**：{s.get('why','')}")
-    else:
-        st.markdown("- （候補なし）")
+#    stack = design.get("stack", {})
+#    complements = stack.get("complements", {})
+#    processing = design.get("processing", {})
+#    deliverables = design.get("deliverables", [])
+#    risks = design.get("risks", [])
+#    next_actions = design.get("next_actions", [])
+#    assumptions = design.get("assumptions", [])
 
 #    st.markdown("#### 補完・取得戦略")
 #    st.markdown(f"- 雲対策: {complements.get('cloud_mitigation', '（未記載）')}")
@@ -270,8 +267,9 @@ def render():
 #        st.markdown("### 前提条件")
 #        st.markdown("- " + "\n- ".join(assumptions))
 
-    # Debug expander
-    with st.expander("デバッグ（MODEL / APIキー有無 / JSON原文）", expanded=False):
-        st.write("MODEL =", MODEL)
-        st.write("Has GROQ_API_KEY =", bool(API_KEY))
-        st.code(json.dumps(design, ensure_ascii=False, indent=2), language="json")
+    # Debug expander（?debug=1 の時のみ）
+    if debug_enabled():
+        with st.expander("デバッグ（MODEL / APIキー有無 / JSON原文）", expanded=False):
+            st.write("MODEL =", get_model())
+            st.write("Has GROQ_API_KEY =", bool(get_api_key()))
+            st.code(orjson.dumps(design, option=orjson.OPT_INDENT_2).decode(), language="json")